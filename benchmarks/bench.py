@@ -0,0 +1,230 @@
+"""Micro-benchmarks for the client hot paths.
+
+Runs offline against a stub Swift proxy started in a child process, so the
+measured CPU time belongs to the client only.
+
+    python benchmarks/bench.py --save benchmarks/baseline.json
+    python benchmarks/bench.py --compare benchmarks/baseline.json --threshold 0.2
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+from time import perf_counter, process_time
+
+import requests
+from stub_server import serve
+
+# benchmark the working tree, not whatever monsterclient happens to be installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPEAT = 5
+MIN_BATCH_TIME = 0.1
+METRICS = ["wall_us", "cpu_us", "alloc_kib"]
+
+
+def measure(func, repeat=REPEAT):
+    func()
+
+    # grow the batch until it is long enough for the clocks to be meaningful
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        if perf_counter() - start >= MIN_BATCH_TIME:
+            break
+        number *= 2
+
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall, cpu = perf_counter(), process_time()
+        for _ in range(number):
+            func()
+        cpus.append((process_time() - cpu) / number)
+        walls.append((perf_counter() - wall) / number)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "wall_us": statistics.median(walls) * 1e6,
+        "cpu_us": statistics.median(cpus) * 1e6,
+        "alloc_kib": peak / 1024,
+    }
+
+
+def setup_connection(workdir, port):
+    # AuthAPI reads ~/.monster, point it at the stub without touching the real one
+    os.environ["HOME"] = workdir
+    with open(os.path.join(workdir, ".monster"), "w") as data:
+        json.dump(
+            {"token": "bench", "monster": f"http://127.0.0.1:{port}/v1/AUTH_bench"},
+            data,
+        )
+
+
+def rendering_benchmarks():
+    from monsterclient.api import Response, convert_to_curl, update_headers
+
+    put_req = requests.Request(
+        method="PUT",
+        url="http://127.0.0.1:8080/v1/AUTH_bench/container/dir/object",
+        headers={"X-Auth-Token": "bench", "X-Object-Meta-Color": "blue"},
+        data=b"x" * 1024,
+    ).prepare()
+    listing = json.dumps(
+        [{"name": f"object-{i}", "bytes": i, "hash": "0" * 32} for i in range(50)]
+    )
+    html = (
+        "<html><body><h1>Not Found</h1>"
+        "<p>The resource could not be found.</p></body></html>"
+    )
+    headers = {
+        "Content-Type": "text/plain",
+        "X-Container-Object-Count": "20",
+        "X-Timestamp": "1704067200.00000",
+    }
+
+    return {
+        "update_headers": lambda: update_headers({}, "X-Object-Meta-Color: blue"),
+        "convert_to_curl": lambda: convert_to_curl(put_req),
+        "response_repr_json": lambda: Response(status_code=200, content=listing).repr(),
+        "response_repr_html": lambda: Response(status_code=404, content=html).repr(),
+        "response_repr_headers": lambda: Response(
+            status_code=204, headers=headers
+        ).repr(),
+    }
+
+
+def api_benchmarks(workdir):
+    from monsterclient.api import MonsterAPI
+
+    api = MonsterAPI()
+    source = os.path.join(workdir, "object")
+    with open(source, "wb") as data:
+        data.write(b"x" * 4096)
+    archive_dir = os.path.join(workdir, "archive")
+    os.makedirs(archive_dir)
+    for i in range(20):
+        with open(os.path.join(archive_dir, f"file-{i}"), "wb") as data:
+            data.write(b"x" * 128)
+    target = os.path.join(workdir, "downloaded")
+    download_dir = os.path.join(workdir, "download")
+
+    def download_fresh():
+        shutil.rmtree(download_dir, ignore_errors=True)
+        api.download_container("container", download_dir, None)
+
+    return {
+        "create_container": lambda: api.create_container("container", None),
+        "upload_object": lambda: api.upload_object("container", "object", None, source),
+        "upload_archive": lambda: api.upload_archive("container", archive_dir, None),
+        "delete_container": lambda: api.delete_container("container", None),
+        "delete_object": lambda: api.delete_object("container", "object", None),
+        "head_account": lambda: api.head_account(None),
+        "head_container": lambda: api.head_container("container", None),
+        "head_object": lambda: api.head_object("container", "object", None),
+        "get_account": lambda: api.get_account(None),
+        "get_container": lambda: api.get_container("container", None),
+        "get_object": lambda: api.get_object("container", "object", None, target),
+        "post_account": lambda: api.post_account(None),
+        "post_container": lambda: api.post_container("container", None),
+        "post_object": lambda: api.post_object("container", "object", None),
+        "get_info": lambda: api.get_info(),
+        "download_container": download_fresh,
+        "download_container_up_to_date": lambda: api.download_container(
+            "container", download_dir, None
+        ),
+    }
+
+
+def run(selected):
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue,), daemon=True)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="monster-bench-")
+    try:
+        setup_connection(workdir, port_queue.get(timeout=10))
+        benchmarks = {**rendering_benchmarks(), **api_benchmarks(workdir)}
+        results = {}
+        for name, func in benchmarks.items():
+            if selected and not any(pattern in name for pattern in selected):
+                continue
+            results[name] = measure(func)
+            print(format_result(name, results[name]))
+        return results
+    finally:
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_result(name, result):
+    return (
+        f"{name:32} {result['wall_us']:12.1f} us wall"
+        f" {result['cpu_us']:12.1f} us cpu {result['alloc_kib']:10.1f} KiB peak"
+    )
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in METRICS:
+            old, new = baseline[name][metric], result[metric]
+            if old > 0 and new > old * (1 + threshold):
+                regressions.append(
+                    f"{name}: {metric} {old:.1f} -> {new:.1f} (+{(new / old - 1):.0%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", help="Store the results as a baseline file")
+    parser.add_argument("--compare", help="Baseline file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown that counts as a regression (default 0.2)",
+    )
+    parser.add_argument(
+        "-k", dest="selected", action="append", help="Only run matching benchmarks"
+    )
+    args = parser.parse_args()
+
+    results = run(args.selected)
+
+    if args.save:
+        with open(args.save, "w") as data:
+            json.dump(
+                {"python": platform.python_version(), "results": results},
+                data,
+                indent=4,
+            )
+
+    if args.compare:
+        with open(args.compare, "r") as data:
+            baseline = json.load(data)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions above {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
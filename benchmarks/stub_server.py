@@ -0,0 +1,91 @@
+import json
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OBJECT_BODY = b"x" * 4096
+OBJECT_HASH = hashlib.md5(OBJECT_BODY).hexdigest()
+LISTING = [
+    {
+        "name": f"dir/object-{i}",
+        "bytes": len(OBJECT_BODY),
+        "hash": OBJECT_HASH,
+        "content_type": "application/octet-stream",
+        "last_modified": "2024-01-01T00:00:00.000000",
+    }
+    for i in range(20)
+]
+INFO = {"swift": {"version": "2.33.0", "max_file_size": 5368709122}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every request like a Swift proxy would, without storing anything."""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, avoid delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                self.rfile.read(size + 2)
+                if size == 0:
+                    break
+        else:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def json_reply(self, data):
+        self.reply(200, json.dumps(data).encode(), {"Content-Type": "application/json"})
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/info":
+            return self.json_reply(INFO)
+
+        depth = len(path.strip("/").split("/"))
+        if depth == 2:
+            return self.json_reply([{"name": "container", "count": 20, "bytes": 1}])
+        if depth == 3:
+            # a single page, the marker of the next request ends the listing
+            return self.json_reply([] if "marker=" in query else LISTING)
+        self.reply(200, OBJECT_BODY, {"ETag": OBJECT_HASH})
+
+    def do_HEAD(self):
+        self.reply(204, headers={"X-Container-Object-Count": "20"})
+
+    def do_PUT(self):
+        self.read_body()
+        if "extract-archive" in self.path:
+            return self.json_reply(
+                {
+                    "Number Files Created": 20,
+                    "Response Status": "201 Created",
+                    "Errors": [],
+                    "Response Body": "",
+                }
+            )
+        self.reply(201)
+
+    def do_POST(self):
+        self.reply(204)
+
+    def do_DELETE(self):
+        self.reply(204)
+
+
+def serve(port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
@@ -1,12 +1,18 @@
+import io
 import os
+import sys
 import json
+import hashlib
+import tarfile
 import warnings
 import requests
 from shlex import quote
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import quote as url_quote, urlparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pygments import highlight, lexers, formatters
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
+from monsterclient.balancer import EndpointPool, STRATEGIES, base_url
 
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
 
@@ -18,6 +24,75 @@ UNWANTED_HEADERS = [
     "Content-Length",
 ]
 
+CHUNK_SIZE = 64 * 1024
+STDIO_PATH = "-"
+PARTIAL_SUFFIX = ".part"
+# stays under the default connection pool size of a requests.Session
+DOWNLOAD_WORKERS = 8
+
+
+def read_in_chunks(stream, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in read_in_chunks(f):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def local_object_path(directory, object_name):
+    root = os.path.abspath(directory)
+    path = os.path.normpath(os.path.join(root, *object_name.split("/")))
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise Exception(f"Object name escapes the target directory: {object_name}")
+    return path
+
+
+def tar_directory(directory):
+    # headers come from TarInfo.tobuf and contents are read in CHUNK_SIZE
+    # pieces, so not even a single file has to fit in memory
+    tar = tarfile.TarFile(fileobj=io.BytesIO(), mode="w", dereference=True)
+    offset = 0
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            arcname = Path(os.path.relpath(path, directory)).as_posix()
+            info = tar.gettarinfo(path, arcname=arcname)
+            if info is None or not info.isreg():
+                continue
+
+            header = info.tobuf(tar.format, tar.encoding, tar.errors)
+            yield header
+            offset += len(header)
+
+            with open(path, "rb") as f:
+                remaining = info.size
+                while remaining:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise Exception(f"{path} changed while archiving")
+                    yield chunk
+                    remaining -= len(chunk)
+
+            padding = -info.size % tarfile.BLOCKSIZE
+            if padding:
+                yield tarfile.NUL * padding
+            offset += info.size + padding
+
+    # two empty blocks end the archive, which is then padded to a full record
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(offset + end) % tarfile.RECORDSIZE
+    yield tarfile.NUL * end
+
 
 def update_headers(headers, kv):
     new_headers = headers
@@ -42,7 +117,9 @@ def convert_to_curl(request, compressed=False, verify=True, preserve_body=False)
         auth_index = [
             i for i, word in enumerate(splited_url) if word.startswith("AUTH")
         ][0]
-        if len(splited_url) > auth_index + 2:
+        if request.headers.get("Transfer-Encoding") == "chunked":
+            parts += [("-T", STDIO_PATH)]
+        elif len(splited_url) > auth_index + 2:
             file_name = "".join(splited_url[auth_index + 2 :])
             parts += [("-T", file_name)]
 
@@ -223,8 +300,9 @@ class AuthAPI:
 
     def set_new_monster_connection(self, token: Token):
         token, monster_endpoint, response = token.get_token()
-        token_json = {"token": token, "monster": monster_endpoint}
-        self.write_to_monster_connection_file(token_json)
+        monster_conn = self.read_from_monster_connection_file()
+        monster_conn.update({"token": token, "monster": monster_endpoint})
+        self.write_to_monster_connection_file(monster_conn)
 
         modified_curl = convert_to_curl(response.request, preserve_body=True)
 
@@ -256,6 +334,27 @@ class AuthAPI:
             status_code=200,
         )
 
+    def set_endpoints(self, endpoints, balance):
+        if balance not in STRATEGIES:
+            raise Exception(f"Balance strategy must be one of: {', '.join(STRATEGIES)}")
+        for endpoint in endpoints:
+            parsed_url = urlparse(endpoint)
+            if parsed_url.scheme not in ["http", "https"] or not parsed_url.netloc:
+                raise Exception(
+                    f"Endpoint must look like http(s)://host:port, got: {endpoint}"
+                )
+        monster_conn = self.read_from_monster_connection_file()
+        if endpoints:
+            monster_conn["endpoints"] = [base_url(endpoint) for endpoint in endpoints]
+            monster_conn["balance"] = balance
+        else:
+            monster_conn.pop("endpoints", None)
+            monster_conn.pop("balance", None)
+        self.write_to_monster_connection_file(monster_conn)
+        return Response(
+            status_code=200,
+        )
+
     def read_from_monster_connection_file(self):
         path = self.path
         try:
@@ -273,6 +372,7 @@ class MonsterAPI:
         self.monster_endpoint = connection["monster"]
         self.token = connection["token"]
         self.headers = {"X-Auth-Token": self.token}
+        self.pool = EndpointPool.from_connection(connection)
 
     # Create
     def create_container(self, container_name, new_headers):
@@ -283,9 +383,7 @@ class MonsterAPI:
             method="PUT", url=f"{url}/{container_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
 
@@ -295,12 +393,16 @@ class MonsterAPI:
             curl=modified_curl,
         )
 
-    def upload_object(self, container_name, object_name, new_headers):
+    def upload_object(self, container_name, object_name, new_headers, source=None):
         url = self.monster_endpoint
         headers = update_headers(self.headers, new_headers)
 
-        with open(object_name, "rb") as f:
-            data = f.read()
+        if source == STDIO_PATH:
+            # a generator body makes requests use chunked transfer encoding
+            data = read_in_chunks(sys.stdin.buffer)
+        else:
+            with open(source or object_name, "rb") as f:
+                data = f.read()
 
         req = requests.Request(
             method="PUT",
@@ -309,9 +411,7 @@ class MonsterAPI:
             data=data,
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -320,6 +420,47 @@ class MonsterAPI:
             curl=modified_curl,
         )
 
+    def upload_archive(self, container_name, directory, new_headers):
+        if not os.path.isdir(directory):
+            raise Exception(f"No such directory: {directory}")
+
+        url = self.monster_endpoint
+        headers = {**update_headers(self.headers, new_headers)}
+        headers.update({"Accept": "application/json"})
+
+        req = requests.Request(
+            method="PUT",
+            url=f"{url}/{container_name}",
+            params={"extract-archive": "tar"},
+            headers=headers,
+            data=tar_directory(directory),
+        )
+
+        prepared_req, response = self.pool.send(req)
+
+        modified_curl = convert_to_curl(prepared_req)
+        try:
+            report = response.json()
+        except ValueError:
+            return Response(
+                status_code=response.status_code,
+                content=response.content.decode(),
+                curl=modified_curl,
+            )
+
+        errors = [f"{status}: {name}" for name, status in report.get("Errors", [])]
+        # a failure of the whole archive is only explained in the response body
+        report_status = str(report.get("Response Status", ""))
+        if not report_status.startswith("2") and report.get("Response Body"):
+            errors.insert(0, report["Response Body"])
+        return Response(
+            status_code=response.status_code,
+            content=f"{report.get('Response Status')}, "
+            f"{report.get('Number Files Created')} files created",
+            errors="\n".join(errors) if errors else None,
+            curl=modified_curl,
+        )
+
     # Delete
     def delete_container(self, container_name, new_headers):
         url = self.monster_endpoint
@@ -329,9 +470,7 @@ class MonsterAPI:
             method="DELETE", url=f"{url}/{container_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -350,9 +489,7 @@ class MonsterAPI:
             headers=headers,
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -368,9 +505,7 @@ class MonsterAPI:
 
         req = requests.Request(method="HEAD", url=f"{url}", headers=headers)
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -387,9 +522,7 @@ class MonsterAPI:
             method="HEAD", url=f"{url}/{container_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -406,9 +539,7 @@ class MonsterAPI:
             method="HEAD", url=f"{url}/{container_name}/{object_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -424,9 +555,7 @@ class MonsterAPI:
 
         req = requests.Request(method="GET", url=f"{url}", headers=headers)
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -443,9 +572,7 @@ class MonsterAPI:
             method="GET", url=f"{url}/{container_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -454,7 +581,7 @@ class MonsterAPI:
             curl=modified_curl,
         )
 
-    def get_object(self, container_name, object_name, new_headers):
+    def get_object(self, container_name, object_name, new_headers, target=None):
         url = self.monster_endpoint
         headers = update_headers(self.headers, new_headers)
 
@@ -462,12 +589,13 @@ class MonsterAPI:
             method="GET", url=f"{url}/{container_name}/{object_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        if target == STDIO_PATH:
+            return self.stream_object(req)
+
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
-        with open(f"{object_name}", "wb") as data:
+        with open(f"{target or object_name}", "wb") as data:
             data.write(response.content)
 
         try:
@@ -482,6 +610,167 @@ class MonsterAPI:
                 curl=modified_curl,
             )
 
+    def stream_object(self, req):
+        prepared_req, response = self.pool.send(req, stream=True)
+
+        modified_curl = convert_to_curl(prepared_req)
+        if not response.ok:
+            return Response(
+                status_code=response.status_code,
+                content=response.content.decode(),
+                curl=modified_curl,
+            )
+
+        out = sys.stdout.buffer
+        with response:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                out.write(chunk)
+        out.flush()
+
+        return Response(
+            status_code=response.status_code,
+            curl=modified_curl,
+        )
+
+    def list_objects(self, container_name, headers, prefix=None):
+        url = self.monster_endpoint
+        marker = None
+
+        while True:
+            req = requests.Request(
+                method="GET",
+                url=f"{url}/{url_quote(container_name, safe='')}",
+                params={"format": "json", "prefix": prefix, "marker": marker},
+                headers=headers,
+            )
+            prepared_req, response = self.pool.send(req)
+            if not response.ok:
+                raise Exception(
+                    f"Listing {container_name} failed with {response.status_code}"
+                )
+
+            objects = response.json()
+            if not objects:
+                break
+            yield from objects
+            marker = objects[-1]["name"]
+
+    def download_container(
+        self,
+        container_name,
+        directory,
+        new_headers,
+        prefix=None,
+        workers=DOWNLOAD_WORKERS,
+    ):
+        headers = update_headers(self.headers, new_headers)
+
+        counts = {"downloaded": 0, "skipped": 0}
+        errors = []
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    counts["downloaded" if future.result() else "skipped"] += 1
+                except Exception as e:
+                    errors.append(f"{name}: {e}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for obj in self.list_objects(container_name, headers, prefix):
+                name = obj["name"]
+                try:
+                    path = local_object_path(directory, name)
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+
+                if name.endswith("/") or obj["content_type"] == "application/directory":
+                    os.makedirs(path, exist_ok=True)
+                    continue
+
+                # keep only a few downloads queued instead of the whole listing
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                future = executor.submit(
+                    self.download_object, container_name, obj, path, headers
+                )
+                pending[future] = name
+
+            collect(wait(pending)[0])
+
+        return Response(
+            content=f"{counts['downloaded']} downloaded, "
+            f"{counts['skipped']} up to date, {len(errors)} failed",
+            errors="\n".join(errors) if errors else None,
+        )
+
+    def download_object(self, container_name, obj, path, headers):
+        # large objects never match here, their listing size and hash describe
+        # the manifest rather than the content, so they are always downloaded
+        size = obj["bytes"]
+        if (
+            os.path.isfile(path)
+            and os.path.getsize(path) == size
+            and file_md5(path) == obj["hash"]
+        ):
+            return False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = path + PARTIAL_SUFFIX
+        offset = 0
+        if os.path.isfile(partial_path):
+            offset = os.path.getsize(partial_path)
+            if offset >= size:
+                offset = 0
+
+        request_headers = {**headers}
+        if offset:
+            # a changed object comes back whole with 200 instead of appended
+            request_headers.update(
+                {"Range": f"bytes={offset}-", "If-Range": f'"{obj["hash"]}"'}
+            )
+
+        url = self.monster_endpoint
+        req = requests.Request(
+            method="GET",
+            url=f"{url}/{url_quote(container_name, safe='')}/{url_quote(obj['name'])}",
+            headers=request_headers,
+        )
+        prepared_req, response = self.pool.send(req, stream=True)
+
+        with response:
+            if response.status_code == 206:
+                mode = "ab"
+            elif response.status_code == 200:
+                mode = "wb"
+            else:
+                raise Exception(f"status {response.status_code}")
+
+            with open(partial_path, mode) as data:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    data.write(chunk)
+
+        # a large object manifest is listed with the size and hash of the
+        # manifest, not of the content, so neither can be checked against it
+        manifest = "X-Static-Large-Object" in response.headers or (
+            "X-Object-Manifest" in response.headers
+        )
+        if not manifest:
+            if os.path.getsize(partial_path) != size:
+                raise Exception("incomplete download, run again to resume")
+            if file_md5(partial_path) != obj["hash"]:
+                os.remove(partial_path)
+                if offset:
+                    # the partial file came from another version, start over
+                    return self.download_object(container_name, obj, path, headers)
+                raise Exception("checksum mismatch")
+        os.replace(partial_path, path)
+        return True
+
     # Metadata
     def post_account(self, new_headers):
         url = self.monster_endpoint
@@ -489,9 +778,7 @@ class MonsterAPI:
 
         req = requests.Request(method="POST", url=f"{url}", headers=headers)
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
 
@@ -509,9 +796,7 @@ class MonsterAPI:
             method="POST", url=f"{url}/{container_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -528,9 +813,7 @@ class MonsterAPI:
             method="POST", url=f"{url}/{container_name}/{object_name}", headers=headers
         )
 
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        prepared_req, response = self.pool.send(req)
 
         modified_curl = convert_to_curl(prepared_req)
         return Response(
@@ -541,14 +824,10 @@ class MonsterAPI:
 
     # Info
     def get_info(self):
-        url = self.monster_endpoint
+        url = base_url(self.monster_endpoint)
 
-        parsed_url = urlparse(url)
-        base_url = parsed_url.scheme + "://" + parsed_url.netloc
-        req = requests.Request(method="GET", url=f"{base_url}/info")
-        with requests.Session() as session:
-            prepared_req = session.prepare_request(req)
-            response = session.send(prepared_req)
+        req = requests.Request(method="GET", url=f"{url}/info")
+        prepared_req, response = self.pool.send(req)
         modified_curl = convert_to_curl(prepared_req)
         return Response(
             status_code=response.status_code,
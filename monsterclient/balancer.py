@@ -0,0 +1,154 @@
+import time
+import random
+import threading
+import requests
+from collections.abc import Iterator
+from urllib.parse import urlparse
+from urllib3.exceptions import NewConnectionError
+
+ROUND_ROBIN = "round-robin"
+LEAST_OUTSTANDING = "least-outstanding"
+STRATEGIES = [LEAST_OUTSTANDING, ROUND_ROBIN]
+
+RETRY_UNHEALTHY_AFTER = 30
+SAFE_METHODS = ["GET", "HEAD", "OPTIONS"]
+
+
+def base_url(url):
+    parsed_url = urlparse(url)
+    return parsed_url.scheme + "://" + parsed_url.netloc
+
+
+def replace_base_url(url, new_base):
+    parsed_url = urlparse(url)
+    parsed_base = urlparse(new_base)
+    return parsed_url._replace(
+        scheme=parsed_base.scheme, netloc=parsed_base.netloc
+    ).geturl()
+
+
+def is_connect_error(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class Endpoint:
+    def __init__(self, url) -> None:
+        self.url = base_url(url)
+        self.session = requests.Session()
+        self.outstanding = 0
+        self.healthy = True
+        self.down_since = 0.0
+
+    def check_health(self):
+        try:
+            response = self.session.get(f"{self.url}/info", timeout=5)
+            return response.status_code < 500
+        except requests.exceptions.RequestException:
+            return False
+
+
+class EndpointPool:
+    def __init__(
+        self, urls, strategy=LEAST_OUTSTANDING, retry_after=RETRY_UNHEALTHY_AFTER
+    ) -> None:
+        if strategy not in STRATEGIES:
+            raise Exception(f"Unknown balance strategy: {strategy}")
+
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.strategy = strategy
+        self.retry_after = retry_after
+        # separate CLI runs each build a new pool, so don't all start at the first
+        self.next_index = random.randrange(len(self.endpoints))
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_connection(cls, connection):
+        urls = connection.get("endpoints") or [connection["monster"]]
+        strategy = connection.get("balance") or LEAST_OUTSTANDING
+        return cls(urls, strategy)
+
+    def revive_endpoints(self):
+        now = time.monotonic()
+        with self.lock:
+            due = [
+                endpoint
+                for endpoint in self.endpoints
+                if not endpoint.healthy
+                and now - endpoint.down_since >= self.retry_after
+            ]
+            # push the next probe out so concurrent callers don't pile on
+            for endpoint in due:
+                endpoint.down_since = now
+
+        for endpoint in due:
+            if endpoint.check_health():
+                endpoint.healthy = True
+
+    def candidates(self):
+        self.revive_endpoints()
+
+        with self.lock:
+            endpoints = [e for e in self.endpoints if e.healthy] or self.endpoints
+            start = self.next_index % len(endpoints)
+            self.next_index += 1
+            ordered = endpoints[start:] + endpoints[:start]
+            if self.strategy == LEAST_OUTSTANDING:
+                # stable sort keeps the round-robin order between equals
+                ordered.sort(key=lambda endpoint: endpoint.outstanding)
+
+        return ordered
+
+    def mark_unhealthy(self, endpoint):
+        with self.lock:
+            endpoint.healthy = False
+            endpoint.down_since = time.monotonic()
+
+    def send(self, req, **kwargs):
+        # a streamed body is consumed by the first attempt and can't be resent
+        replayable = not isinstance(req.data, Iterator)
+        candidates = self.candidates()
+        original_url = req.url
+        failed = None
+
+        for attempt, endpoint in enumerate(candidates, start=1):
+            last_attempt = attempt == len(candidates) or not replayable
+            req.url = replace_base_url(original_url, endpoint.url)
+            prepared_req = endpoint.session.prepare_request(req)
+
+            with self.lock:
+                endpoint.outstanding += 1
+            try:
+                response = endpoint.session.send(prepared_req, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self.mark_unhealthy(endpoint)
+                # Only fail over when the request can't have reached the server
+                # (no connection was made) or the method is safe to repeat. A
+                # dropped connection may come after the server acted, so a
+                # retried DELETE would report 404 and a POST would run twice.
+                if not last_attempt and (
+                    is_connect_error(e) or req.method in SAFE_METHODS
+                ):
+                    continue
+                if not last_attempt or failed is None:
+                    raise
+                return failed
+            finally:
+                with self.lock:
+                    endpoint.outstanding -= 1
+
+            if response.status_code >= 500:
+                self.mark_unhealthy(endpoint)
+                # same rule as above, a proxy may fail after it already acted
+                if not last_attempt and req.method in SAFE_METHODS:
+                    # keep the server error in case no other endpoint answers
+                    if failed is not None:
+                        failed[1].close()
+                    failed = prepared_req, response
+                    continue
+
+            if failed is not None:
+                failed[1].close()
+            return prepared_req, response
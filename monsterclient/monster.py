@@ -1,5 +1,7 @@
+import sys
 import click
-from monsterclient.api import MonsterAPI, AuthAPI, TokenV1, TokenV3
+from monsterclient.api import MonsterAPI, AuthAPI, TokenV1, TokenV3, DOWNLOAD_WORKERS
+from monsterclient.balancer import STRATEGIES, LEAST_OUTSTANDING
 
 monsterAPI = MonsterAPI()
 authAPI = AuthAPI()
@@ -25,6 +27,35 @@ def project(id):
         handle_exception(e)
 
 
+@click.command(help="Set proxy endpoints to spread requests across")
+@click.argument("urls", nargs=-1)
+@click.option(
+    "-b",
+    "--balance",
+    type=click.Choice(STRATEGIES),
+    default=LEAST_OUTSTANDING,
+    help="How requests are spread across the endpoints",
+)
+@click.option(
+    "--clear",
+    is_flag=True,
+    help="Remove the configured endpoints and go back to the monster URL",
+)
+def endpoints(urls, balance, clear):
+    try:
+        if urls or clear:
+            response = authAPI.set_endpoints([] if clear else urls, balance)
+            click.echo(f"{response.repr()}")
+        else:
+            monster_conn = authAPI.read_from_monster_connection_file()
+            if monster_conn.get("endpoints"):
+                click.echo(f"balance: {monster_conn.get('balance', LEAST_OUTSTANDING)}")
+            for url in monster_conn.get("endpoints", []):
+                click.echo(f"{url}")
+    except Exception as e:
+        handle_exception(e)
+
+
 @click.command(help="GET a new token")
 @click.option("-c", "--curl", is_flag=True, help="Prints cURL equivalent if specified")
 @click.option("-v", "--version", help="Auth version")
@@ -73,18 +104,53 @@ def head(container, obj, header, curl):
     help="You can add headers to your request using this option",
 )
 @click.option("-c", "--curl", is_flag=True, help="Prints cURL equivalent if specified")
-def get(container, obj, header, curl):
+@click.option(
+    "--to",
+    "target",
+    help="Local path to save the object to, use - to stream it to stdout",
+)
+@click.option(
+    "-r",
+    "--recursive",
+    is_flag=True,
+    help="Download every object of the container",
+)
+@click.option("--prefix", help="Only download objects starting with this prefix")
+@click.option(
+    "-d",
+    "--directory",
+    default=".",
+    help="Local directory to download the container to",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=DOWNLOAD_WORKERS,
+    help="Number of parallel downloads",
+)
+def get(container, obj, header, curl, target, recursive, prefix, directory, workers):
+    if recursive and not container:
+        raise click.UsageError("--recursive needs a container")
+
     try:
-        if obj and container:
-            response = monsterAPI.get_object(container, obj, header)
+        if container and recursive:
+            response = monsterAPI.download_container(
+                container, directory, header, prefix, workers
+            )
+        elif obj and container:
+            response = monsterAPI.get_object(container, obj, header, target)
         elif not obj and container:
             response = monsterAPI.get_container(container, header)
         else:
             response = monsterAPI.get_account(header)
 
-        click.echo(f"{response.repr(curl=curl)}")
+        # keep stdout clean for the object body when piping
+        click.echo(f"{response.repr(curl=curl)}", err=target == "-")
+        if target == "-" and response.status_code >= 400:
+            sys.exit(1)
     except Exception as e:
-        handle_exception(e)
+        handle_exception(e, piped=target == "-")
 
 
 @click.command(help="PUT Container | Object")
@@ -96,16 +162,28 @@ def get(container, obj, header, curl):
     help="To set metadata use: X-{Container|Object}-Meta-Key: Value",
 )
 @click.option("-c", "--curl", is_flag=True, help="Prints cURL equivalent if specified")
-def put(container, obj, header, curl):
+@click.option(
+    "--from",
+    "source",
+    help="Local path to read the object from, use - to stream it from stdin",
+)
+@click.option(
+    "--archive",
+    is_flag=True,
+    help="Upload the files of directory <obj> in one request as a tar archive",
+)
+def put(container, obj, header, curl, source, archive):
     try:
-        if obj:
-            response = monsterAPI.upload_object(container, obj, header)
+        if obj and archive:
+            response = monsterAPI.upload_archive(container, obj, header)
+        elif obj:
+            response = monsterAPI.upload_object(container, obj, header, source)
         else:
             response = monsterAPI.create_container(container, header)
 
         click.echo(f"{response.repr(curl=curl)}")
     except Exception as e:
-        handle_exception(e)
+        handle_exception(e, piped=source == "-")
 
 
 @click.command(help="POST Account | Container | Object")
@@ -168,6 +246,7 @@ def main():
 
 
 main.add_command(project)
+main.add_command(endpoints)
 main.add_command(token)
 main.add_command(head)
 main.add_command(get)
@@ -177,16 +256,23 @@ main.add_command(delete)
 main.add_command(info)
 
 
-def handle_exception(e):
-    click.echo("Sorry, something is wrong \U0001F641")
-    click.echo("You may want to try the followings:")
-    click.echo("\U0001F449 Get token via monster token")
-    click.echo("\U0001F449 Check your env variables to see if they are correctly set.")
-    click.echo("\U0001F449 Check your connection by monster info")
-    click.echo("\U0001F449 Maybe you are issuing a wrong command?")
-    click.echo()
-    click.echo(f"Error: {str(e)}")
-    click.echo()
+def handle_exception(e, piped=False):
+    # when stdout carries an object body, keep everything else off it
+    click.echo("Sorry, something is wrong \U0001F641", err=piped)
+    click.echo("You may want to try the followings:", err=piped)
+    click.echo("\U0001F449 Get token via monster token", err=piped)
+    click.echo(
+        "\U0001F449 Check your env variables to see if they are correctly set.",
+        err=piped,
+    )
+    click.echo("\U0001F449 Check your connection by monster info", err=piped)
+    click.echo("\U0001F449 Maybe you are issuing a wrong command?", err=piped)
+    click.echo(err=piped)
+    click.echo(f"Error: {str(e)}", err=piped)
+    click.echo(err=piped)
+    if piped:
+        click.echo(main.get_help(click.Context(main, info_name="monster")), err=True)
+        sys.exit(1)
     main("--help")
 
 